@@ -3,19 +3,25 @@ Main entry point for the Calendar Reminder Bot.
 """
 
 import sys
+import signal
 import argparse
 from pathlib import Path
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.config import validate_config, LOG_LEVEL, LOG_FILE, CHECK_INTERVAL_MINUTES
+from src.config import CONFIG, validate_config
 from src.utils.logger import setup_logger
 from src.scheduler import ReminderScheduler
 from src.notification_service import NotificationService
 
 # Set up main logger
-logger = setup_logger('main', log_file=LOG_FILE, level=LOG_LEVEL)
+logger = setup_logger('main', log_file=CONFIG.log_file, level=CONFIG.log_level)
+
+
+def _handle_sigterm(signum, frame):
+    """Turn SIGTERM into a KeyboardInterrupt so the normal shutdown path runs."""
+    raise KeyboardInterrupt
 
 
 def main():
@@ -87,21 +93,26 @@ Examples:
         logger.error("  3. Your .env file is configured correctly")
         sys.exit(1)
     
+    # Stop the same way on SIGTERM (systemd, Docker) as on Ctrl+C, so the
+    # in-memory database is saved before exiting
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    
     # Run mode
-    if args.once:
-        logger.info("Running in ONCE mode - single check...")
-        scheduler.run_once()
-        logger.info("✅ Single check completed")
-    else:
-        logger.info("Running in CONTINUOUS mode...")
-        logger.info(f"Checking for reminders every {CHECK_INTERVAL_MINUTES} minutes")
-        logger.info("Press Ctrl+C to stop")
-        
-        try:
-            scheduler.run(check_interval_minutes=CHECK_INTERVAL_MINUTES)
-        except KeyboardInterrupt:
-            logger.info("\n👋 Shutting down gracefully...")
-            sys.exit(0)
+    try:
+        if args.once:
+            logger.info("Running in ONCE mode - single check...")
+            scheduler.run_once()
+            logger.info("✅ Single check completed")
+        else:
+            logger.info("Running in CONTINUOUS mode...")
+            logger.info(f"Checking for reminders every {CONFIG.check_interval_minutes} minutes")
+            logger.info("Press Ctrl+C to stop")
+            
+            scheduler.run(check_interval_minutes=CONFIG.check_interval_minutes)
+    except KeyboardInterrupt:
+        logger.info("\n👋 Shutting down gracefully...")
+    finally:
+        scheduler.shutdown()
 
 
 if __name__ == '__main__':
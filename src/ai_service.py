@@ -3,31 +3,94 @@ AI-powered service for intelligent event analysis and reminder scheduling.
 Uses Google Gemini to understand events and determine optimal reminder timings.
 """
 
-import json
-from datetime import datetime, timedelta
-import google.generativeai as genai
+import asyncio
+import math
+import re
+from datetime import datetime, timedelta, timezone
+import orjson
 
-from .config import GEMINI_API_KEY
+from .config import CONFIG
+from .utils.async_loop import run_coroutine
 from .utils.logger import setup_logger
 
 logger = setup_logger('ai')
 
-# Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
+MODEL_NAME = 'gemini-1.5-flash'
+
+# Static instructions, sent as the system instruction and kept at the very start
+# of every request so Gemini's implicit prefix caching can apply
+SYSTEM_PROMPT = """You are an intelligent calendar assistant. Analyze each upcoming event you are given and determine the optimal reminder strategy.
+
+Your task:
+1. Generate a natural, friendly summary of this event (1-2 sentences)
+2. Rate the event's importance from 1-10 based on:
+   - Number of attendees (more = higher importance)
+   - Duration (longer = more important)
+   - Keywords in title/description (meeting with CEO, interview, deadline, etc.)
+3. Determine optimal reminder times based on:
+   - Event location (if it requires travel, remind earlier for commute planning)
+   - Event type (important meetings need more reminders)
+   - Duration (longer events need advance preparation)
+   - Time until event (don't remind too early if event is far away)
+4. For each reminder, provide a contextual message
+
+Rules:
+- If location is specified, assume 30-60 minutes travel time and remind accordingly
+- For very important events (8+), provide 3-4 reminders
+- For normal events (5-7), provide 2-3 reminders  
+- For low importance (1-4), provide 1-2 reminders
+- First reminder should be at least 12-24 hours before (for awareness)
+- Always have a final reminder 10-15 minutes before
+- If event is within 1 hour, only send one immediate reminder
+- Reminder times must be in the future (not in the past)
+
+Respond ONLY with valid JSON in this exact format:
+{
+  "natural_summary": "friendly event description",
+  "importance_score": 7,
+  "reminder_schedule": [
+    {
+      "hours_before": 24,
+      "message": "Reminder message for this timing"
+    },
+    {
+      "hours_before": 2,
+      "message": "Another reminder message"
+    }
+  ]
+}"""
+
+# Markdown code fence wrapping a JSON reply
+_JSON_FENCE = re.compile(r'^\s*```(?:json)?\s*\n?(.*?)\n?\s*```\s*$', re.DOTALL)
+
+# Delay of the single reminder sent when no scheduled one is left (5 minutes)
+IMMEDIATE_REMINDER_HOURS = 5 / 60
+
+# Upper bound on events per Gemini request, keeps the JSON reply within output limits
+MAX_BATCH_SIZE = 10
+
+# Gemini requests allowed in flight at once
+MAX_CONCURRENT_REQUESTS = 5
 
 
 class AIService:
     """Provides AI-powered event analysis and reminder generation."""
     
     def __init__(self):
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Imported here so runs that never analyze events don't load the Gemini SDK
+        import google.generativeai as genai
+        
+        # Configure Gemini
+        genai.configure(api_key=CONFIG.gemini_api_key)
+        self.model = genai.GenerativeModel(MODEL_NAME, system_instruction=SYSTEM_PROMPT)
     
-    def analyze_event_and_generate_reminders(self, event):
+    def analyze_event_and_generate_reminders(self, event, now=None):
         """
         Analyze an event and determine optimal reminder timings.
         
         Args:
             event: Parsed event dictionary from CalendarService
+            now: Current time (aware datetime); read from the clock if omitted
         
         Returns:
             Dictionary containing:
@@ -35,17 +98,33 @@ class AIService:
             - importance_score: 1-10 rating
             - reminder_times: List of datetime objects when reminders should be sent
             - reminder_messages: List of message strings for each reminder
+            - is_fallback: True if default reminders were used instead of an AI plan
         """
+        return run_coroutine(self.analyze_event_async(event, now))
+    
+    async def analyze_event_async(self, event, now=None):
+        """Async version of analyze_event_and_generate_reminders."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        
+        analysis = self._heuristic_analysis(event, now)
+        if analysis is not None:
+            return analysis
+        
         try:
             # Prepare event context for AI
-            event_context = self._prepare_event_context(event)
+            event_context = self._prepare_event_context(event, now)
             
             # Generate AI analysis
             prompt = self._create_analysis_prompt(event_context)
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
             
             # Parse AI response
-            analysis = self._parse_ai_response(response.text, event)
+            plan = self._parse_ai_response(response.text)
+            if plan is None:
+                return self._fallback_analysis(event, now)
+            
+            analysis = self._build_analysis(plan, event, now)
             
             logger.info(f"AI analysis for '{event['summary']}': {len(analysis['reminder_times'])} reminders scheduled")
             return analysis
@@ -53,12 +132,147 @@ class AIService:
         except Exception as e:
             logger.error(f"AI analysis failed: {e}")
             # Fallback to default behavior
-            return self._fallback_analysis(event)
+            return self._fallback_analysis(event, now)
+    
+    def analyze_events_batch(self, events):
+        """
+        Analyze several events, sending them to Gemini in batched requests.
+        
+        Events are grouped into requests of up to MAX_BATCH_SIZE so the static
+        instructions are sent once per batch instead of once per event. A batch
+        whose reply can't be parsed falls back to per-event analysis. Requests run
+        concurrently, at most MAX_CONCURRENT_REQUESTS at a time.
+        
+        Args:
+            events: List of parsed event dictionaries from CalendarService
+        
+        Returns:
+            List of analysis dictionaries (see analyze_event_and_generate_reminders),
+            in the same order as events
+        """
+        return run_coroutine(self.analyze_events_batch_async(events))
     
-    def _prepare_event_context(self, event):
+    async def analyze_events_batch_async(self, events):
+        """Async version of analyze_events_batch."""
+        now = datetime.now(timezone.utc)
+        results = [None] * len(events)
+        misses = []
+        
+        for i, event in enumerate(events):
+            analysis = self._heuristic_analysis(event, now)
+            if analysis is not None:
+                results[i] = analysis
+            else:
+                misses.append((i, event))
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        
+        async def analyze_single(i, event):
+            async with semaphore:
+                results[i] = await self.analyze_event_async(event, now)
+        
+        async def analyze(batch):
+            async with semaphore:
+                plans = await self._analyze_batch([event for _, event in batch], now)
+            
+            unanswered = []
+            for (i, event), plan in zip(batch, plans):
+                if plan is not None:
+                    try:
+                        results[i] = self._build_analysis(plan, event, now)
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Unusable batched plan for '{event['summary']}': {e}")
+                
+                unanswered.append(analyze_single(i, event))
+            
+            await asyncio.gather(*unanswered)
+        
+        await asyncio.gather(*(
+            analyze(misses[start:start + MAX_BATCH_SIZE])
+            for start in range(0, len(misses), MAX_BATCH_SIZE)
+        ))
+        
+        return results
+    
+    async def _analyze_batch(self, events, now):
+        """
+        Request reminder plans for a batch of events in a single Gemini call.
+        
+        Returns:
+            List with one plan per event; None for events whose plan is missing
+            or for the whole batch if the reply couldn't be parsed
+        """
+        # A single event goes through the regular per-event prompt
+        if len(events) == 1:
+            return [None]
+        
+        try:
+            contexts = []
+            for idx, event in enumerate(events):
+                context = self._prepare_event_context(event, now)
+                context['idx'] = idx
+                context['hours_until_event'] = round(context['hours_until_event'], 1)
+                contexts.append(context)
+            
+            prompt = self._create_batch_prompt(contexts)
+            response = await self.model.generate_content_async(prompt)
+            
+            ai_items = orjson.loads(self._strip_code_fence(response.text))
+            if not isinstance(ai_items, list):
+                raise ValueError("expected a JSON array")
+            
+            plans = [None] * len(events)
+            for ai_data in ai_items:
+                idx = ai_data.get('idx') if isinstance(ai_data, dict) else None
+                if isinstance(idx, int) and 0 <= idx < len(events):
+                    plans[idx] = self._plan_from_data(ai_data)
+            
+            logger.info(f"Batched AI analysis: {sum(p is not None for p in plans)}/{len(events)} events")
+            return plans
+        
+        except Exception as e:
+            logger.warning(f"Batched AI analysis failed: {e}. Analyzing events individually.")
+            return [None] * len(events)
+    
+    def _heuristic_analysis(self, event, now):
+        """
+        Handle events that don't need the AI.
+        
+        Events starting within the hour skip the AI: they get one immediate
+        reminder, or none if they start within IMMEDIATE_REMINDER_HOURS (as with
+        an AI plan, which could not schedule one either). Trivial events (solo,
+        no location, short, more than two days away) get the default schedule.
+        
+        Returns:
+            Analysis dictionary, or None if the event should be analyzed by the AI
+        """
+        hours_until = (event['start_time'].timestamp() - now.timestamp()) / 3600
+        
+        if hours_until < 1:
+            plan = {'natural_summary': None, 'importance_score': 5, 'reminder_schedule': []}
+            return self._build_analysis(plan, event, now)
+        
+        if self._is_trivial(event, hours_until):
+            logger.debug(f"Skipping AI for trivial event '{event['summary']}'")
+            return self._fallback_analysis(event, now)
+        
+        return None
+    
+    def _is_trivial(self, event, hours_until):
+        """Check whether an event is simple enough to use the default reminders."""
+        return (
+            event['attendee_count'] == 0
+            and not event['location']
+            and event['duration_minutes'] <= 30
+            and hours_until > 48
+        )
+    
+    def _prepare_event_context(self, event, now=None):
         """Prepare event information for AI prompt."""
-        now = datetime.now(event['start_time'].tzinfo)
-        time_until_event = event['start_time'] - now
+        if now is None:
+            now = datetime.now(timezone.utc)
+        hours_until_event = (event['start_time'].timestamp() - now.timestamp()) / 3600
         
         context = {
             'title': event['summary'],
@@ -68,16 +282,14 @@ class AIService:
             'duration_minutes': event['duration_minutes'],
             'is_all_day': event['is_all_day'],
             'attendee_count': event['attendee_count'],
-            'hours_until_event': time_until_event.total_seconds() / 3600,
+            'hours_until_event': hours_until_event,
             'has_location': bool(event['location']),
         }
         return context
     
     def _create_analysis_prompt(self, context):
-        """Create the AI prompt for event analysis."""
-        prompt = f"""You are an intelligent calendar assistant. Analyze this upcoming event and determine the optimal reminder strategy.
-
-Event Details:
+        """Create the per-event part of the AI prompt (rules live in SYSTEM_PROMPT)."""
+        prompt = f"""Event Details:
 - Title: {context['title']}
 - Description: {context['description'] or 'None'}
 - Location: {context['location'] or 'None'}
@@ -85,139 +297,138 @@ Event Details:
 - Duration: {context['duration_minutes']} minutes
 - All-day event: {context['is_all_day']}
 - Number of attendees: {context['attendee_count']}
-- Hours until event: {context['hours_until_event']:.1f}
-
-Your task:
-1. Generate a natural, friendly summary of this event (1-2 sentences)
-2. Rate the event's importance from 1-10 based on:
-   - Number of attendees (more = higher importance)
-   - Duration (longer = more important)
-   - Keywords in title/description (meeting with CEO, interview, deadline, etc.)
-3. Determine optimal reminder times based on:
-   - Event location (if it requires travel, remind earlier for commute planning)
-   - Event type (important meetings need more reminders)
-   - Duration (longer events need advance preparation)
-   - Time until event (don't remind too early if event is far away)
-4. For each reminder, provide a contextual message
+- Hours until event: {context['hours_until_event']:.1f}"""
+        return prompt
+    
+    def _create_batch_prompt(self, contexts):
+        """Create the per-batch part of the AI prompt for several events."""
+        prompt = f"""Analyze each of the following events independently.
 
-Rules:
-- If location is specified, assume 30-60 minutes travel time and remind accordingly
-- For very important events (8+), provide 3-4 reminders
-- For normal events (5-7), provide 2-3 reminders  
-- For low importance (1-4), provide 1-2 reminders
-- First reminder should be at least 12-24 hours before (for awareness)
-- Always have a final reminder 10-15 minutes before
-- If event is within 1 hour, only send one immediate reminder
-- Reminder times must be in the future (not in the past)
+Events (JSON):
+{orjson.dumps(contexts).decode()}
 
-Respond ONLY with valid JSON in this exact format:
-{{
-  "natural_summary": "friendly event description",
-  "importance_score": 7,
-  "reminder_schedule": [
-    {{
-      "hours_before": 24,
-      "message": "Reminder message for this timing"
-    }},
-    {{
-      "hours_before": 2,
-      "message": "Another reminder message"
-    }}
-  ]
-}}"""
+Respond ONLY with a valid JSON array containing one object per event, each in the format described above plus an "idx" field equal to the event's idx."""
         return prompt
     
-    def _parse_ai_response(self, response_text, event):
-        """Parse the AI's JSON response and convert to reminder times."""
+    def _parse_ai_response(self, response_text):
+        """
+        Parse the AI's JSON response into a reminder plan.
+        
+        The plan keeps reminders relative to the event start (hours_before);
+        _build_analysis turns them into reminder times.
+        
+        Returns:
+            Plan dictionary, or None if the response couldn't be parsed
+        """
         try:
-            # Extract JSON from response (remove markdown code blocks if present)
-            json_text = response_text.strip()
-            if json_text.startswith('```json'):
-                json_text = json_text[7:]
-            if json_text.startswith('```'):
-                json_text = json_text[3:]
-            if json_text.endswith('```'):
-                json_text = json_text[:-3]
-            json_text = json_text.strip()
-            
-            # Parse JSON
-            ai_data = json.loads(json_text)
-            
-            # Calculate actual reminder datetimes
-            reminder_times = []
-            reminder_messages = []
-            now = datetime.now(event['start_time'].tzinfo)
-            
-            for reminder in ai_data.get('reminder_schedule', []):
-                hours_before = reminder.get('hours_before', 1)
-                reminder_time = event['start_time'] - timedelta(hours=hours_before)
-                
-                # Only include reminders that are in the future
-                if reminder_time > now:
-                    reminder_times.append(reminder_time)
-                    reminder_messages.append(reminder.get('message', 'Upcoming event reminder'))
-            
-            # If no valid reminders, add at least one
-            if not reminder_times:
-                reminder_time = now + timedelta(minutes=5)
-                if reminder_time < event['start_time']:
-                    reminder_times.append(reminder_time)
-                    reminder_messages.append(f"Immediate reminder: {event['summary']} is coming up soon!")
-            
-            return {
-                'natural_summary': ai_data.get('natural_summary', event['summary']),
-                'importance_score': ai_data.get('importance_score', 5),
-                'reminder_times': reminder_times,
-                'reminder_messages': reminder_messages
-            }
-        
-        except json.JSONDecodeError as e:
+            ai_data = orjson.loads(self._strip_code_fence(response_text))
+            return self._plan_from_data(ai_data)
+        
+        except orjson.JSONDecodeError as e:
             logger.warning(f"Failed to parse AI JSON response: {e}. Using fallback.")
-            return self._fallback_analysis(event)
+            return None
         except Exception as e:
             logger.error(f"Error processing AI response: {e}")
-            return self._fallback_analysis(event)
+            return None
     
-    def _fallback_analysis(self, event):
-        """Provide default analysis if AI fails."""
-        now = datetime.now(event['start_time'].tzinfo)
-        time_until = event['start_time'] - now
-        hours_until = time_until.total_seconds() / 3600
+    def _strip_code_fence(self, response_text):
+        """Extract JSON from a response (remove markdown code blocks if present)."""
+        json_text = response_text.lstrip()
+        
+        # Fast path: bare JSON needs no unwrapping
+        if json_text.startswith(('{', '[')):
+            return json_text
+        
+        match = _JSON_FENCE.match(json_text)
+        return match.group(1) if match else json_text
+    
+    def _plan_from_data(self, ai_data):
+        """
+        Build a reminder plan from one decoded AI JSON object.
+        
+        Reminders whose hours_before isn't a non-negative number are dropped.
+        """
+        reminder_schedule = []
+        for reminder in ai_data.get('reminder_schedule') or []:
+            try:
+                hours_before = float(reminder.get('hours_before', 1))
+            except (AttributeError, TypeError, ValueError):
+                logger.warning(f"Ignoring malformed reminder in AI response: {reminder!r}")
+                continue
+            
+            if not 0 <= hours_before < math.inf:
+                logger.warning(f"Ignoring reminder with invalid hours_before: {hours_before}")
+                continue
+            
+            reminder_schedule.append((hours_before, reminder.get('message') or 'Upcoming event reminder'))
+        
+        return {
+            'natural_summary': ai_data.get('natural_summary'),
+            'importance_score': ai_data.get('importance_score', 5),
+            'reminder_schedule': reminder_schedule
+        }
+    
+    def _build_analysis(self, plan, event, now=None):
+        """Convert a reminder plan into concrete reminder times for the event."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        start_time = event['start_time']
+        hours_until = (start_time.timestamp() - now.timestamp()) / 3600
         
         reminder_times = []
         reminder_messages = []
         
+        for hours_before, message in plan['reminder_schedule']:
+            # Only include reminders that are in the future
+            if hours_before < hours_until:
+                reminder_times.append(start_time - timedelta(hours=hours_before))
+                reminder_messages.append(message)
+        
+        # If no valid reminders, add at least one
+        if not reminder_times and hours_until > IMMEDIATE_REMINDER_HOURS:
+            reminder_times.append(now.astimezone(start_time.tzinfo) + timedelta(hours=IMMEDIATE_REMINDER_HOURS))
+            reminder_messages.append(f"Immediate reminder: {event['summary']} is coming up soon!")
+        
+        return {
+            'natural_summary': plan['natural_summary'] or event['summary'],
+            'importance_score': plan['importance_score'],
+            'reminder_times': reminder_times,
+            'reminder_messages': reminder_messages,
+            'is_fallback': False
+        }
+    
+    def _fallback_analysis(self, event, now=None):
+        """Provide default analysis if AI fails."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        start_time = event['start_time']
+        hours_until = (start_time.timestamp() - now.timestamp()) / 3600
+        
         # Default reminder schedule based on time until event
-        if hours_until > 24:
-            # Add 24-hour reminder
-            reminder_times.append(event['start_time'] - timedelta(hours=24))
-            reminder_messages.append(f"Tomorrow: {event['summary']}")
-        
-        if hours_until > 2:
-            # Add 2-hour reminder
-            reminder_times.append(event['start_time'] - timedelta(hours=2))
-            reminder_messages.append(f"In 2 hours: {event['summary']}")
-        
-        if hours_until > 0.25:  # 15 minutes
-            # Add 15-minute reminder
-            reminder_times.append(event['start_time'] - timedelta(minutes=15))
-            reminder_messages.append(f"Starting soon: {event['summary']}")
-        
-        # Filter out past reminders
-        valid_reminders = [(t, m) for t, m in zip(reminder_times, reminder_messages) if t > now]
-        
-        if valid_reminders:
-            reminder_times, reminder_messages = zip(*valid_reminders)
-            reminder_times = list(reminder_times)
-            reminder_messages = list(reminder_messages)
-        else:
+        default_schedule = (
+            (24, f"Tomorrow: {event['summary']}"),
+            (2, f"In 2 hours: {event['summary']}"),
+            (0.25, f"Starting soon: {event['summary']}"),  # 15 minutes
+        )
+        
+        reminder_times = []
+        reminder_messages = []
+        
+        # Only keep reminders that are still in the future
+        for hours_before, message in default_schedule:
+            if hours_until > hours_before:
+                reminder_times.append(start_time - timedelta(hours=hours_before))
+                reminder_messages.append(message)
+        
+        if not reminder_times:
             # At least one immediate reminder
-            reminder_times = [now + timedelta(minutes=5)]
+            reminder_times = [now.astimezone(start_time.tzinfo) + timedelta(hours=IMMEDIATE_REMINDER_HOURS)]
             reminder_messages = [f"Reminder: {event['summary']} is coming up!"]
         
         return {
             'natural_summary': event['summary'],
             'importance_score': 5,
             'reminder_times': reminder_times,
-            'reminder_messages': reminder_messages
+            'reminder_messages': reminder_messages,
+            'is_fallback': True
         }
@@ -4,8 +4,8 @@ Handles authentication and event fetching.
 """
 
 import os
-import pickle
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -13,18 +13,40 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import pytz
 
-from .config import GOOGLE_CREDENTIALS_PATH, TOKEN_PATH, SCOPES, TIMEZONE
+from .config import CONFIG
 from .utils.logger import setup_logger
 
 logger = setup_logger('calendar')
 
+# Events per page when syncing (API maximum)
+SYNC_PAGE_SIZE = 2500
+
+# Most upcoming events returned per call
+MAX_EVENTS = 50
+
+# End time used for all-day events
+END_OF_DAY = time(23, 59, 59)
+
 
 class CalendarService:
     """Manages Google Calendar API interactions."""
     
-    def __init__(self):
+    def __init__(self, db=None):
+        """
+        Args:
+            db: Optional ReminderDatabase used to persist sync state across restarts
+        """
         self.service = None
-        self.timezone = pytz.timezone(TIMEZONE)
+        self.timezone = pytz.timezone(CONFIG.timezone)
+        self._localize = self.timezone.localize
+        self.db = db
+        self._watch_channel = None
+        
+        # Incremental sync state: parsed events by id and the token for the next delta
+        self._events = {}
+        self._sync_token = None
+        self._etag = None
+        self._state_loaded = False
     
     def authenticate(self):
         """
@@ -34,9 +56,12 @@ class CalendarService:
         creds = None
         
         # Load existing token if available
-        if os.path.exists(TOKEN_PATH):
-            with open(TOKEN_PATH, 'rb') as token:
-                creds = pickle.load(token)
+        if os.path.exists(CONFIG.token_path):
+            try:
+                creds = Credentials.from_authorized_user_file(CONFIG.token_path, CONFIG.scopes)
+            except ValueError as e:
+                # Tokens saved by older versions were pickled, not JSON
+                logger.warning(f"Stored token is unreadable, re-authenticating: {e}")
         
         # If no valid credentials, authenticate
         if not creds or not creds.valid:
@@ -46,14 +71,13 @@ class CalendarService:
             else:
                 logger.info("Starting new authentication flow...")
                 flow = InstalledAppFlow.from_client_secrets_file(
-                    GOOGLE_CREDENTIALS_PATH, SCOPES
+                    CONFIG.google_credentials_path, CONFIG.scopes
                 )
                 creds = flow.run_local_server(port=0)
             
             # Save credentials for future use
-            os.makedirs(os.path.dirname(TOKEN_PATH), exist_ok=True)
-            with open(TOKEN_PATH, 'wb') as token:
-                pickle.dump(creds, token)
+            os.makedirs(os.path.dirname(CONFIG.token_path), exist_ok=True)
+            Path(CONFIG.token_path).write_text(creds.to_json())
             logger.info("Authentication successful!")
         
         self.service = build('calendar', 'v3', credentials=creds)
@@ -61,7 +85,10 @@ class CalendarService:
     
     def get_upcoming_events(self, hours_ahead=168):
         """
-        Fetch upcoming events from the primary calendar.
+        Get upcoming events from the primary calendar.
+        
+        Events are kept up to date with incremental sync: only changes since
+        the previous call are downloaded.
         
         Args:
             hours_ahead: How many hours ahead to look for events (default: 7 days)
@@ -73,37 +100,184 @@ class CalendarService:
             raise RuntimeError("Calendar service not authenticated. Call authenticate() first.")
         
         try:
-            # Calculate time range
-            now = datetime.now(self.timezone)
-            time_max = now + timedelta(hours=hours_ahead)
-            
-            logger.info(f"Fetching events from {now} to {time_max}")
+            self._sync_events()
+        except HttpError as error:
+            logger.error(f"An error occurred: {error}")
+            return []
+        
+        # Calculate time range
+        now = datetime.now(self.timezone)
+        time_max = now + timedelta(hours=hours_ahead)
+        
+        upcoming = sorted(
+            (event for event in self._events.values()
+             if event['end_time'] > now and event['start_time'] < time_max),
+            key=lambda event: event['start_time']
+        )[:MAX_EVENTS]
+        
+        logger.info(f"Found {len(upcoming)} upcoming events")
+        return upcoming
+    
+    def _sync_events(self):
+        """
+        Bring the local event copy up to date with the calendar.
+        
+        The first sync downloads all events and stores the returned sync token;
+        later syncs send the token and only receive changed or cancelled events.
+        An expired token (HTTP 410) triggers a new full sync.
+        """
+        if not self._state_loaded:
+            self._load_sync_state()
+        
+        full_sync = self._sync_token is None
+        params = {
+            'calendarId': 'primary',
+            'singleEvents': True,
+            'maxResults': SYNC_PAGE_SIZE
+        }
+        if full_sync:
+            logger.info("Running full calendar sync")
+            self._events.clear()
+        else:
+            params['syncToken'] = self._sync_token
+        
+        changed = {}
+        removed = set()
+        page_token = None
+        
+        while True:
+            request = self.service.events().list(pageToken=page_token, **params)
             
-            # Call the Calendar API
-            events_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=now.isoformat(),
-                timeMax=time_max.isoformat(),
-                maxResults=50,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+            # Let the server answer 304 with no body when nothing has changed
+            if self._etag and not full_sync and page_token is None:
+                request.headers['If-None-Match'] = self._etag
             
-            events = events_result.get('items', [])
-            logger.info(f"Found {len(events)} upcoming events")
+            try:
+                result = request.execute()
+            except HttpError as error:
+                if error.resp.status == 304:
+                    logger.info("Calendar unchanged since last sync")
+                    return
+                if error.resp.status == 410 and not full_sync:
+                    logger.info("Calendar sync token expired, running full sync")
+                    self._sync_token = None
+                    self._etag = None
+                    return self._sync_events()
+                raise
             
-            # Parse and structure event data
-            parsed_events = []
-            for event in events:
-                parsed_event = self._parse_event(event)
+            for item in result.get('items', []):
+                event_id = item.get('id')
+                parsed_event = None if item.get('status') == 'cancelled' else self._parse_event(item)
                 if parsed_event:
-                    parsed_events.append(parsed_event)
+                    self._events[event_id] = parsed_event
+                    changed[event_id] = item
+                else:
+                    self._events.pop(event_id, None)
+                    changed.pop(event_id, None)
+                    removed.add(event_id)
             
-            return parsed_events
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        
+        # Forget events that are already over
+        now = datetime.now(self.timezone)
+        for event_id in [eid for eid, event in self._events.items() if event['end_time'] <= now]:
+            del self._events[event_id]
+            changed.pop(event_id, None)
+            removed.add(event_id)
+        
+        self._sync_token = result.get('nextSyncToken')
+        self._etag = result.get('etag')
+        logger.info(f"Calendar sync: {len(changed)} changed, {len(removed)} removed events")
+        
+        if self.db:
+            self.db.save_calendar_sync_state(self._sync_token, changed, removed, replace=full_sync)
+    
+    def _load_sync_state(self):
+        """Restore the sync token and stored events saved by a previous run."""
+        self._state_loaded = True
+        if not self.db:
+            return
         
+        sync_token, raw_events = self.db.get_calendar_sync_state()
+        if not sync_token:
+            return
+        
+        for raw_event in raw_events:
+            parsed_event = self._parse_event(raw_event)
+            if parsed_event:
+                self._events[parsed_event['id']] = parsed_event
+        self._sync_token = sync_token
+        logger.info(f"Restored {len(self._events)} events from previous sync")
+    
+    def start_watch(self, webhook_url, channel_id, token=None):
+        """
+        Subscribe to push notifications for changes on the primary calendar.
+        
+        Args:
+            webhook_url: Public HTTPS address Google will POST notifications to
+            channel_id: Channel identifier (kept stable across restarts)
+            token: Secret echoed back in every notification
+        
+        Returns:
+            True if the channel was created, False otherwise
+        """
+        if not self.service:
+            raise RuntimeError("Calendar service not authenticated. Call authenticate() first.")
+        
+        body = {
+            'id': channel_id,
+            'type': 'web_hook',
+            'address': webhook_url
+        }
+        if token:
+            body['token'] = token
+        
+        try:
+            channel = self.service.events().watch(calendarId='primary', body=body).execute()
         except HttpError as error:
-            logger.error(f"An error occurred: {error}")
-            return []
+            logger.error(f"Failed to start calendar watch: {error}")
+            return False
+        
+        expiration = int(channel.get('expiration', 0)) / 1000
+        self._watch_channel = {
+            'id': channel['id'],
+            'resource_id': channel['resourceId'],
+            'expiration': datetime.fromtimestamp(expiration, self.timezone) if expiration else None
+        }
+        logger.info(f"Watching calendar for changes (channel {channel_id})")
+        return True
+    
+    def stop_watch(self):
+        """Stop the active push notification channel, if any."""
+        if not self._watch_channel:
+            return
+        
+        try:
+            self.service.channels().stop(body={
+                'id': self._watch_channel['id'],
+                'resourceId': self._watch_channel['resource_id']
+            }).execute()
+            logger.info("Stopped calendar watch")
+        except HttpError as error:
+            logger.warning(f"Failed to stop calendar watch: {error}")
+        
+        self._watch_channel = None
+    
+    def is_watching(self):
+        """Check whether a push notification channel is active."""
+        return self._watch_channel is not None
+    
+    def watch_needs_renewal(self, margin_hours=1):
+        """Check whether there is no watch channel or it expires within margin_hours."""
+        if not self._watch_channel:
+            return True
+        
+        expiration = self._watch_channel['expiration']
+        if expiration is None:
+            return False
+        return expiration - datetime.now(self.timezone) < timedelta(hours=margin_hours)
     
     def _parse_event(self, event):
         """
@@ -123,23 +297,24 @@ class CalendarService:
             
             # Parse start time
             start = event.get('start', {})
-            if 'dateTime' in start:
-                start_time = datetime.fromisoformat(start['dateTime'])
+            start_value = start.get('dateTime')
+            is_all_day = start_value is None
+            if not is_all_day:
+                start_time = datetime.fromisoformat(start_value)
             elif 'date' in start:
                 # All-day event
-                start_time = datetime.fromisoformat(start['date'] + 'T00:00:00')
-                start_time = self.timezone.localize(start_time)
+                start_time = self._localize(datetime.combine(date.fromisoformat(start['date']), time.min))
             else:
                 logger.warning(f"Event {event_id} has no valid start time")
                 return None
             
             # Parse end time
             end = event.get('end', {})
-            if 'dateTime' in end:
-                end_time = datetime.fromisoformat(end['dateTime'])
+            end_value = end.get('dateTime')
+            if end_value is not None:
+                end_time = datetime.fromisoformat(end_value)
             elif 'date' in end:
-                end_time = datetime.fromisoformat(end['date'] + 'T23:59:59')
-                end_time = self.timezone.localize(end_time)
+                end_time = self._localize(datetime.combine(date.fromisoformat(end['date']), END_OF_DAY))
             else:
                 end_time = start_time + timedelta(hours=1)  # Default 1 hour
             
@@ -148,9 +323,6 @@ class CalendarService:
             attendee_emails = [a.get('email', '') for a in attendees]
             attendee_count = len(attendees)
             
-            # Check if all-day event
-            is_all_day = 'date' in start
-            
             # Calculate duration
             duration_minutes = int((end_time - start_time).total_seconds() / 60)
             
@@ -166,7 +338,7 @@ class CalendarService:
                 'attendees': attendee_emails,
                 'attendee_count': attendee_count,
                 'html_link': event.get('htmlLink', ''),
-                'raw_event': event
+                'updated': event.get('updated', '')
             }
         
         except Exception as e:
@@ -4,7 +4,9 @@ Loads settings from environment variables and .env file.
 """
 
 import os
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -13,62 +15,106 @@ load_dotenv()
 # Base directory
 BASE_DIR = Path(__file__).parent.parent
 
-# Google Calendar API
-GOOGLE_CREDENTIALS_PATH = os.getenv(
-    'GOOGLE_CREDENTIALS_PATH', 
-    str(BASE_DIR / 'credentials' / 'credentials.json')
-)
-TOKEN_PATH = str(BASE_DIR / 'credentials' / 'token.json')
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
-# Google Gemini AI
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-
-# Notification Channels
-ENABLE_EMAIL = os.getenv('ENABLE_EMAIL', 'false').lower() == 'true'
-ENABLE_TELEGRAM = os.getenv('ENABLE_TELEGRAM', 'false').lower() == 'true'
+@dataclass(frozen=True)
+class Config:
+    """All bot settings, read from the environment once at import."""
+    
+    # Google Calendar API
+    google_credentials_path: str
+    token_path: str
+    scopes: tuple
+    
+    # Google Gemini AI
+    gemini_api_key: Optional[str]
+    
+    # Notification Channels
+    enable_email: bool
+    enable_telegram: bool
+    
+    # Email Configuration
+    email_smtp_server: str
+    email_smtp_port: int
+    email_address: Optional[str]
+    email_password: Optional[str]
+    
+    # Telegram Configuration
+    telegram_bot_token: Optional[str]
+    telegram_chat_id: Optional[str]
+    
+    # Bot Settings
+    check_interval_minutes: int
+    timezone: str
+    
+    # Calendar push notifications (optional, polling is used when no webhook URL is set)
+    calendar_webhook_url: Optional[str]
+    calendar_webhook_port: int
+    calendar_webhook_token: Optional[str]
+    calendar_watch_channel_id: str
+    fallback_poll_minutes: int
+    
+    # Logging
+    log_level: str
+    log_file: str
+    
+    # Database
+    db_path: str
 
-# Email Configuration
-EMAIL_SMTP_SERVER = os.getenv('EMAIL_SMTP_SERVER', 'smtp.gmail.com')
-EMAIL_SMTP_PORT = int(os.getenv('EMAIL_SMTP_PORT', '587'))
-EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
-EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 
-# Telegram Configuration
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+def load_config():
+    """Build the configuration from environment variables."""
+    return Config(
+        google_credentials_path=os.getenv(
+            'GOOGLE_CREDENTIALS_PATH',
+            str(BASE_DIR / 'credentials' / 'credentials.json')
+        ),
+        token_path=str(BASE_DIR / 'credentials' / 'token.json'),
+        scopes=('https://www.googleapis.com/auth/calendar.readonly',),
+        gemini_api_key=os.getenv('GEMINI_API_KEY'),
+        enable_email=os.getenv('ENABLE_EMAIL', 'false').lower() == 'true',
+        enable_telegram=os.getenv('ENABLE_TELEGRAM', 'false').lower() == 'true',
+        email_smtp_server=os.getenv('EMAIL_SMTP_SERVER', 'smtp.gmail.com'),
+        email_smtp_port=int(os.getenv('EMAIL_SMTP_PORT', '587')),
+        email_address=os.getenv('EMAIL_ADDRESS'),
+        email_password=os.getenv('EMAIL_PASSWORD'),
+        telegram_bot_token=os.getenv('TELEGRAM_BOT_TOKEN'),
+        telegram_chat_id=os.getenv('TELEGRAM_CHAT_ID'),
+        check_interval_minutes=int(os.getenv('CHECK_INTERVAL_MINUTES', '15')),
+        timezone=os.getenv('TIMEZONE', 'Europe/Madrid'),
+        calendar_webhook_url=os.getenv('CALENDAR_WEBHOOK_URL'),
+        calendar_webhook_port=int(os.getenv('CALENDAR_WEBHOOK_PORT', '8080')),
+        calendar_webhook_token=os.getenv('CALENDAR_WEBHOOK_TOKEN'),
+        calendar_watch_channel_id=os.getenv('CALENDAR_WATCH_CHANNEL_ID', 'calendar-reminder-bot'),
+        fallback_poll_minutes=int(os.getenv('FALLBACK_POLL_MINUTES', '60')),
+        log_level=os.getenv('LOG_LEVEL', 'INFO'),
+        log_file=os.getenv('LOG_FILE', str(BASE_DIR / 'bot.log')),
+        db_path=str(BASE_DIR / 'reminders.db'),
+    )
 
-# Bot Settings
-CHECK_INTERVAL_MINUTES = int(os.getenv('CHECK_INTERVAL_MINUTES', '15'))
-TIMEZONE = os.getenv('TIMEZONE', 'Europe/Madrid')
 
-# Logging
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-LOG_FILE = os.getenv('LOG_FILE', str(BASE_DIR / 'bot.log'))
+CONFIG = load_config()
 
-# Database
-DB_PATH = str(BASE_DIR / 'reminders.db')
 
 # Validation
-def validate_config():
+def validate_config(config=CONFIG):
     """Validate that required configuration is present."""
     errors = []
     
-    if not GEMINI_API_KEY:
+    if not config.gemini_api_key:
         errors.append("GEMINI_API_KEY is required for AI features")
     
-    if not ENABLE_EMAIL and not ENABLE_TELEGRAM:
+    if not config.enable_email and not config.enable_telegram:
         errors.append("At least one notification channel (EMAIL or TELEGRAM) must be enabled")
     
-    if ENABLE_EMAIL:
-        if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
+    if config.enable_email:
+        if not config.email_address or not config.email_password:
             errors.append("EMAIL_ADDRESS and EMAIL_PASSWORD are required when email is enabled")
     
-    if ENABLE_TELEGRAM:
-        if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+    if config.enable_telegram:
+        if not config.telegram_bot_token or not config.telegram_chat_id:
             errors.append("TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID are required when Telegram is enabled")
     
-    if not os.path.exists(GOOGLE_CREDENTIALS_PATH):
-        errors.append(f"Google credentials file not found at {GOOGLE_CREDENTIALS_PATH}")
+    if not os.path.exists(config.google_credentials_path):
+        errors.append(f"Google credentials file not found at {config.google_credentials_path}")
     
     return errors
@@ -3,34 +3,47 @@ Multi-channel notification service supporting Email and Telegram.
 """
 
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
 from datetime import datetime
-from telegram import Bot
-from telegram.error import TelegramError
 import asyncio
 
-from .config import (
-    ENABLE_EMAIL, ENABLE_TELEGRAM,
-    EMAIL_SMTP_SERVER, EMAIL_SMTP_PORT, EMAIL_ADDRESS, EMAIL_PASSWORD,
-    TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
-)
+from .config import CONFIG
+from .utils.async_loop import get_event_loop, run_coroutine
 from .utils.logger import setup_logger
 
 logger = setup_logger('notifications')
 
+# Seconds to wait for each Telegram API call to complete
+TELEGRAM_TIMEOUT = 10
+
+# Extra seconds allowed for a whole batch on top of the per-message timeout
+TELEGRAM_BATCH_GRACE = 5
+
+# SMTP errors meaning the connection is gone (as do other OSErrors); sending is
+# retried once on a new connection
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+
 
 class NotificationService:
     """Handles sending notifications via multiple channels."""
     
     def __init__(self):
-        self.email_enabled = ENABLE_EMAIL
-        self.telegram_enabled = ENABLE_TELEGRAM
+        self.email_enabled = CONFIG.enable_email
+        self.telegram_enabled = CONFIG.enable_telegram
+        
+        # Authenticated SMTP connection, opened on first email and kept alive
+        self._smtp = None
         
         # Initialize Telegram bot if enabled
         if self.telegram_enabled:
             try:
-                self.telegram_bot = Bot(token=TELEGRAM_BOT_TOKEN)
+                # Imported here so email-only setups never load the Telegram library
+                from telegram import Bot
+                
+                self.telegram_bot = Bot(token=CONFIG.telegram_bot_token)
+                # Keep one loop alive so the bot's HTTP client is reused across sends
+                get_event_loop()
                 logger.info("Telegram bot initialized")
             except Exception as e:
                 logger.error(f"Failed to initialize Telegram bot: {e}")
@@ -45,26 +58,55 @@ class NotificationService:
             reminder_message: AI-generated reminder message
             natural_summary: AI-generated event summary
         """
-        success = False
+        return self.send_reminders_bulk([(event, reminder_message, natural_summary)])[0]
+    
+    def send_reminders_bulk(self, items):
+        """
+        Send several reminders at once, sharing connections between them.
+        
+        All emails go through a single SMTP session and all Telegram messages
+        are sent concurrently on the background loop; the two channels are
+        sent in parallel.
+        
+        Args:
+            items: List of (event, reminder_message, natural_summary) tuples
+        
+        Returns:
+            List of booleans, True for each reminder sent on at least one channel
+        """
+        if not items:
+            return []
         
         # Format the notification content
-        subject, body = self._format_notification(event, reminder_message, natural_summary)
+        notifications = [self._format_notification(*item) for item in items]
+        results = [False] * len(items)
         
-        # Send via enabled channels
+        # Send via enabled channels, each on its own worker. Within a channel the
+        # sends are already batched (one SMTP session, one gather for Telegram).
+        channels = []
         if self.email_enabled:
-            if self._send_email(subject, body):
-                success = True
-                logger.info(f"Email sent for: {event['summary']}")
-        
+            channels.append(('Email', self._send_emails, notifications))
         if self.telegram_enabled:
-            if self._send_telegram(body):
-                success = True
-                logger.info(f"Telegram message sent for: {event['summary']}")
+            channels.append(('Telegram message', self._send_telegram_messages, [body for _, body in notifications]))
+        
+        if len(channels) > 1:
+            with ThreadPoolExecutor(max_workers=len(channels)) as executor:
+                futures = [executor.submit(send, payload) for _, send, payload in channels]
+                outcomes = [future.result() for future in futures]
+        else:
+            outcomes = [send(payload) for _, send, payload in channels]
+        
+        for (channel, _, _), sent_flags in zip(channels, outcomes):
+            for i, sent in enumerate(sent_flags):
+                if sent:
+                    results[i] = True
+                    logger.info(f"{channel} sent for: {items[i][0]['summary']}")
         
-        if not success:
-            logger.warning(f"Failed to send reminder for: {event['summary']}")
+        for (event, _, _), success in zip(items, results):
+            if not success:
+                logger.warning(f"Failed to send reminder for: {event['summary']}")
         
-        return success
+        return results
     
     def _format_notification(self, event, reminder_message, natural_summary):
         """Format notification content."""
@@ -100,46 +142,145 @@ class NotificationService:
         
         return subject, body
     
-    def _send_email(self, subject, body):
-        """Send email notification via SMTP."""
-        try:
-            msg = MIMEMultipart()
-            msg['From'] = EMAIL_ADDRESS
-            msg['To'] = EMAIL_ADDRESS
+    def _send_emails(self, notifications):
+        """
+        Send several emails over the shared SMTP connection.
+        
+        Args:
+            notifications: List of (subject, body) tuples
+        
+        Returns:
+            List of booleans, one per email
+        """
+        results = []
+        
+        for subject, body in notifications:
+            msg = EmailMessage()
+            msg['From'] = CONFIG.email_address
+            msg['To'] = CONFIG.email_address
             msg['Subject'] = subject
+            msg.set_content(body)
             
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Connect to SMTP server
-            with smtplib.SMTP(EMAIL_SMTP_SERVER, EMAIL_SMTP_PORT) as server:
-                server.starttls()
-                server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                server.send_message(msg)
-            
+            results.append(self._send_message(msg))
+        
+        return results
+    
+    def _send_message(self, msg):
+        """Send one email, reconnecting once if the SMTP connection was dropped."""
+        try:
+            self._get_smtp().send_message(msg)
             return True
+        except OSError as e:
+            # SMTP errors are OSErrors too, but refused recipients, rejected data,
+            # etc. would fail again on retry
+            if isinstance(e, smtplib.SMTPException) and not isinstance(e, SMTP_CONNECTION_ERRORS):
+                logger.error(f"Email sending failed: {e}")
+                return False
+            logger.info(f"SMTP connection lost ({e}), reconnecting...")
+            self._reset_smtp()
+        except Exception as e:
+            # e.g. a password smtplib can't encode or a message it can't serialize
+            logger.error(f"Email sending failed: {e}")
+            return False
         
+        try:
+            self._get_smtp().send_message(msg)
+            return True
         except Exception as e:
             logger.error(f"Email sending failed: {e}")
+            self._reset_smtp()
             return False
     
-    def _send_telegram(self, message):
-        """Send Telegram notification."""
+    def _get_smtp(self):
+        """Get the authenticated SMTP connection, connecting if needed."""
+        if self._smtp is None:
+            server = smtplib.SMTP(CONFIG.email_smtp_server, CONFIG.email_smtp_port)
+            try:
+                server.starttls()
+                server.login(CONFIG.email_address, CONFIG.email_password)
+            except Exception:
+                server.close()
+                raise
+            self._smtp = server
+        return self._smtp
+    
+    def _reset_smtp(self):
+        """Drop the SMTP connection so the next email reconnects."""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+    
+    def keep_alive(self):
+        """Ping the SMTP server so the idle connection isn't closed; drop it if it's gone."""
+        if self._smtp is None:
+            return
+        
         try:
-            # Run async telegram send in sync context
-            asyncio.run(self._send_telegram_async(message))
-            return True
+            self._smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            logger.debug("SMTP connection closed by server, will reconnect on next email")
+            self._reset_smtp()
+    
+    def close(self):
+        """Close open connections."""
+        self._reset_smtp()
+    
+    def _send_telegram_messages(self, messages):
+        """
+        Send several Telegram messages concurrently.
+        
+        Args:
+            messages: List of message texts
+        
+        Returns:
+            List of booleans, one per message
+        """
+        try:
+            # Run async telegram sends on the persistent background loop. Messages are
+            # sent concurrently with their own timeouts, so the batch needs about one.
+            outcomes = run_coroutine(
+                self._send_telegram_batch_async(messages),
+                timeout=TELEGRAM_TIMEOUT + TELEGRAM_BATCH_GRACE
+            )
         except Exception as e:
             logger.error(f"Telegram sending failed: {e}")
-            return False
+            return [False] * len(messages)
+        
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                logger.error(f"Telegram sending failed: {outcome}")
+                results.append(False)
+            else:
+                results.append(True)
+        return results
+    
+    async def _send_telegram_batch_async(self, messages):
+        """Async helper sending Telegram messages together; exceptions are returned, not raised."""
+        return await asyncio.gather(
+            *(self._send_telegram_async(message) for message in messages),
+            return_exceptions=True
+        )
     
     async def _send_telegram_async(self, message):
         """Async helper for sending Telegram messages."""
+        from telegram.error import TelegramError
+        
         try:
-            await self.telegram_bot.send_message(
-                chat_id=TELEGRAM_CHAT_ID,
-                text=message,
-                parse_mode='HTML'
+            await asyncio.wait_for(
+                self.telegram_bot.send_message(
+                    chat_id=CONFIG.telegram_chat_id,
+                    text=message,
+                    parse_mode='HTML'
+                ),
+                timeout=TELEGRAM_TIMEOUT
             )
+        except asyncio.TimeoutError:
+            logger.error(f"Telegram send timed out after {TELEGRAM_TIMEOUT}s")
+            raise
         except TelegramError as e:
             logger.error(f"Telegram API error: {e}")
             raise
@@ -1,25 +1,87 @@
 """
 Database module for tracking sent reminders.
-Uses SQLite to prevent duplicate notifications.
+Uses SQLite to prevent duplicate notifications. The working database lives in
+memory and is saved to the database file periodically and on close.
 """
 
+import os
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from contextlib import contextmanager
+import orjson
 
-from .config import DB_PATH
+from .config import CONFIG
 from .utils.logger import setup_logger
 
 logger = setup_logger('database')
 
+# Settings for the in-memory working database
+CONNECTION_PRAGMAS = '''
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+'''
+
+# Prepared statements kept per connection (sqlite3 default is 128 since 3.12, 100 before)
+STATEMENT_CACHE_SIZE = 128
+
+# (event_id, reminder_time) pairs per lookup query, two bound parameters each
+MAX_PAIRS_PER_QUERY = 400
+
+
+def _iso(value):
+    """Return the ISO string for a datetime; precomputed strings pass through."""
+    return value if isinstance(value, str) else value.isoformat()
+
 
 class ReminderDatabase:
     """Manages the SQLite database for tracking sent reminders."""
     
     def __init__(self):
-        self.db_path = DB_PATH
+        self.db_path = CONFIG.db_path
+        
+        # One shared in-memory connection in autocommit mode; transactions are opened
+        # explicitly. The database file is only read here and written by backup(), so
+        # no query or commit waits on disk. Prepared statements are cached on the
+        # connection, keyed by SQL text, and reused across calls.
+        self._conn = sqlite3.connect(
+            ':memory:',
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        self._conn.executescript(CONNECTION_PRAGMAS)
+        # Reentrant so calls made inside transaction() can take it again
+        self._lock = threading.RLock()
+        
+        self._load_from_disk()
         self._init_database()
     
+    def _load_from_disk(self):
+        """Copy the database file, if there is one, into the in-memory database."""
+        if self.db_path == ':memory:' or not os.path.exists(self.db_path):
+            return
+        
+        source = sqlite3.connect(self.db_path)
+        try:
+            source.backup(self._conn)
+        finally:
+            source.close()
+        logger.info(f"Loaded database from {self.db_path}")
+    
+    def backup(self):
+        """Write the in-memory database to the database file."""
+        if self.db_path == ':memory:':
+            return
+        
+        with self._lock:
+            target = sqlite3.connect(self.db_path)
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+        logger.debug(f"Database saved to {self.db_path}")
+    
     def _init_database(self):
         """Create the database tables if they don't exist."""
         with self._get_connection() as conn:
@@ -38,73 +100,170 @@ class ReminderDatabase:
                 )
             ''')
             
-            # Create index for faster lookups
+            # Unique index for lookups; also makes a second insert of a reminder a no-op
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_event_reminder'")
+            if cursor.fetchone() is None:
+                # Databases created before the unique index may hold duplicate rows
+                cursor.execute('''
+                    DELETE FROM sent_reminders
+                    WHERE id NOT IN (
+                        SELECT MIN(id) FROM sent_reminders
+                        GROUP BY event_id, reminder_time
+                    )
+                ''')
+                cursor.execute('DROP INDEX IF EXISTS idx_event_reminder')
+                cursor.execute('''
+                    CREATE UNIQUE INDEX ux_event_reminder 
+                    ON sent_reminders(event_id, reminder_time)
+                ''')
+            
+            # Tables for incremental calendar sync
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_event_reminder 
-                ON sent_reminders(event_id, reminder_time)
+                CREATE TABLE IF NOT EXISTS calendar_sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS calendar_events (
+                    event_id TEXT PRIMARY KEY,
+                    event_json TEXT NOT NULL
+                )
+            ''')
+            
+            # AI analyses, so restarts don't repeat the AI calls for unchanged events
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS event_analysis (
+                    event_id TEXT PRIMARY KEY,
+                    event_hash INTEGER NOT NULL,
+                    analysis_json TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
             ''')
             
-            conn.commit()
             logger.info("Database initialized")
     
     @contextmanager
     def _get_connection(self):
-        """Context manager for database connections."""
-        conn = sqlite3.connect(self.db_path)
-        try:
+        """Context manager giving exclusive use of the shared connection."""
+        with self._lock:
+            try:
+                yield self._conn
+            except BaseException:
+                # Also on KeyboardInterrupt (and SIGTERM, which main.py turns into one),
+                # so the shared connection is never left inside a dead transaction
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+                raise
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager running the enclosed calls in one write transaction.
+        
+        Commits when the block exits and rolls back if it raises. Nested uses
+        join the outer transaction.
+        """
+        with self._get_connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            
+            conn.execute('BEGIN IMMEDIATE')
             yield conn
-        finally:
-            conn.close()
+            conn.commit()
     
-    def reminder_already_sent(self, event_id, reminder_time):
+    def close(self):
+        """Save the database to its file and close the connection."""
+        with self._lock:
+            self.backup()
+            self._conn.close()
+    
+    def get_sent_set(self, pairs):
         """
-        Check if a reminder has already been sent for this event at this time.
+        Find which of several reminders have already been sent, in one query.
         
         Args:
-            event_id: Event ID from Google Calendar
-            reminder_time: Datetime when the reminder should be sent
+            pairs: Iterable of (event_id, reminder_time) tuples; reminder_time may be
+                a datetime or its ISO string
         
         Returns:
-            True if reminder was already sent, False otherwise
+            Set of (event_id, reminder_time ISO string) tuples already sent
         """
+        keys = [(event_id, _iso(reminder_time)) for event_id, reminder_time in pairs]
+        sent = set()
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                SELECT COUNT(*) FROM sent_reminders
-                WHERE event_id = ? AND reminder_time = ?
-            ''', (event_id, reminder_time.isoformat()))
-            
-            count = cursor.fetchone()[0]
-            return count > 0
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), MAX_PAIRS_PER_QUERY):
+                chunk = keys[start:start + MAX_PAIRS_PER_QUERY]
+                values = ', '.join(['(?, ?)'] * len(chunk))
+                cursor.execute(f'''
+                    SELECT event_id, reminder_time FROM sent_reminders
+                    WHERE (event_id, reminder_time) IN (VALUES {values})
+                ''', [value for key in chunk for value in key])
+                sent.update(cursor.fetchall())
+        
+        return sent
     
-    def mark_reminder_sent(self, event_id, event_title, event_start_time, reminder_time):
+    def try_claim_reminders(self, rows):
         """
-        Mark a reminder as sent in the database.
+        Record several reminders as sent, in one transaction, unless they already are.
+        
+        Claiming before sending makes each reminder go out only once; claims for
+        reminders that couldn't be delivered are undone with release_reminders.
         
         Args:
-            event_id: Event ID from Google Calendar
-            event_title: Event title/summary
-            event_start_time: When the event starts
-            reminder_time: When the reminder was scheduled for
+            rows: List of (event_id, event_title, event_start_time, reminder_time) tuples;
+                times may be datetimes or their ISO strings
+        
+        Returns:
+            List of booleans, True for each reminder claimed by this call
         """
-        with self._get_connection() as conn:
+        if not rows:
+            return []
+        
+        claimed = []
+        sent_at = datetime.now().isoformat()
+        
+        with self.transaction() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                INSERT INTO sent_reminders 
-                (event_id, event_title, event_start_time, reminder_time, sent_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                event_id,
-                event_title,
-                event_start_time.isoformat(),
-                reminder_time.isoformat(),
-                datetime.now().isoformat()
-            ))
-            
-            conn.commit()
-            logger.debug(f"Marked reminder as sent: {event_title} at {reminder_time}")
+            for event_id, event_title, event_start_time, reminder_time in rows:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO sent_reminders 
+                    (event_id, event_title, event_start_time, reminder_time, sent_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (
+                    event_id,
+                    event_title,
+                    _iso(event_start_time),
+                    _iso(reminder_time),
+                    sent_at
+                ))
+                claimed.append(cursor.rowcount == 1)
+        
+        logger.debug(f"Claimed {sum(claimed)} of {len(rows)} reminder(s)")
+        return claimed
+    
+    def release_reminders(self, pairs):
+        """
+        Undo claims for reminders that couldn't be delivered, so they are retried.
+        
+        Args:
+            pairs: List of (event_id, reminder_time) tuples
+        """
+        if not pairs:
+            return
+        
+        with self.transaction() as conn:
+            conn.executemany('''
+                DELETE FROM sent_reminders
+                WHERE event_id = ? AND reminder_time = ?
+            ''', [(event_id, _iso(reminder_time)) for event_id, reminder_time in pairs])
     
     def cleanup_old_reminders(self, days_old=30):
         """
@@ -118,8 +277,7 @@ class ReminderDatabase:
             
             cutoff_date = datetime.now().replace(
                 hour=0, minute=0, second=0, microsecond=0
-            )
-            cutoff_date = cutoff_date.replace(day=cutoff_date.day - days_old)
+            ) - timedelta(days=days_old)
             
             cursor.execute('''
                 DELETE FROM sent_reminders
@@ -127,10 +285,14 @@ class ReminderDatabase:
             ''', (cutoff_date.isoformat(),))
             
             deleted_count = cursor.rowcount
-            conn.commit()
             
             if deleted_count > 0:
                 logger.info(f"Cleaned up {deleted_count} old reminder records")
+            
+            cursor.execute('''
+                DELETE FROM event_analysis
+                WHERE updated_at < ?
+            ''', (cutoff_date.isoformat(),))
     
     def get_reminder_stats(self):
         """Get statistics about sent reminders."""
@@ -144,8 +306,7 @@ class ReminderDatabase:
             # Reminders in the last 7 days
             week_ago = datetime.now().replace(
                 hour=0, minute=0, second=0, microsecond=0
-            )
-            week_ago = week_ago.replace(day=week_ago.day - 7)
+            ) - timedelta(days=7)
             
             cursor.execute('''
                 SELECT COUNT(*) FROM sent_reminders
@@ -157,3 +318,108 @@ class ReminderDatabase:
                 'total_reminders_sent': total,
                 'reminders_last_7_days': last_week
             }
+    
+    def get_calendar_sync_state(self):
+        """
+        Load the saved calendar sync state.
+        
+        Returns:
+            Tuple of (sync_token or None, list of raw event dictionaries)
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT value FROM calendar_sync_state WHERE key = 'sync_token'")
+            row = cursor.fetchone()
+            sync_token = row[0] if row else None
+            
+            cursor.execute('SELECT event_json FROM calendar_events')
+            raw_events = [orjson.loads(event_json) for (event_json,) in cursor.fetchall()]
+            
+            return sync_token, raw_events
+    
+    def save_calendar_sync_state(self, sync_token, changed_events, removed_event_ids, replace=False):
+        """
+        Save the calendar sync token and apply event changes.
+        
+        Args:
+            sync_token: Token for the next incremental sync
+            changed_events: Dictionary of event_id -> raw event to insert or update
+            removed_event_ids: Event IDs to delete
+            replace: Drop all stored events first (after a full sync)
+        """
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            
+            if replace:
+                cursor.execute('DELETE FROM calendar_events')
+            
+            cursor.executemany(
+                'DELETE FROM calendar_events WHERE event_id = ?',
+                [(event_id,) for event_id in removed_event_ids]
+            )
+            cursor.executemany(
+                'INSERT OR REPLACE INTO calendar_events (event_id, event_json) VALUES (?, ?)',
+                [(event_id, orjson.dumps(event).decode()) for event_id, event in changed_events.items()]
+            )
+            cursor.execute(
+                "INSERT OR REPLACE INTO calendar_sync_state (key, value) VALUES ('sync_token', ?)",
+                (sync_token,)
+            )
+    
+    def get_event_analyses(self, event_ids):
+        """
+        Load stored AI analyses for several events, in one query per chunk.
+        
+        Args:
+            event_ids: Iterable of event IDs
+        
+        Returns:
+            Dictionary of event_id -> (event_hash, analysis); reminder times in
+            the analysis are datetimes again
+        """
+        event_ids = list(event_ids)
+        analyses = {}
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            for start in range(0, len(event_ids), MAX_PAIRS_PER_QUERY):
+                chunk = event_ids[start:start + MAX_PAIRS_PER_QUERY]
+                placeholders = ', '.join(['?'] * len(chunk))
+                cursor.execute(f'''
+                    SELECT event_id, event_hash, analysis_json FROM event_analysis
+                    WHERE event_id IN ({placeholders})
+                ''', chunk)
+                
+                for event_id, event_hash, analysis_json in cursor.fetchall():
+                    analysis = orjson.loads(analysis_json)
+                    analysis['reminder_times'] = [
+                        datetime.fromisoformat(value) for value in analysis['reminder_times']
+                    ]
+                    analyses[event_id] = (event_hash, analysis)
+        
+        return analyses
+    
+    def save_event_analyses(self, rows):
+        """
+        Store AI analyses, replacing earlier ones for the same events.
+        
+        Args:
+            rows: List of (event_id, event_hash, analysis) tuples
+        """
+        if not rows:
+            return
+        
+        updated_at = datetime.now().isoformat()
+        
+        with self.transaction() as conn:
+            # orjson writes the reminder datetimes as ISO strings
+            conn.executemany('''
+                INSERT OR REPLACE INTO event_analysis 
+                (event_id, event_hash, analysis_json, updated_at)
+                VALUES (?, ?, ?, ?)
+            ''', [
+                (event_id, event_hash, orjson.dumps(analysis).decode(), updated_at)
+                for event_id, event_hash, analysis in rows
+            ])
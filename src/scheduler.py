@@ -2,30 +2,66 @@
 Scheduler for checking calendar and sending reminders.
 """
 
+import hashlib
 import schedule
+import sqlite3
 import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 from .calendar_service import CalendarService
 from .ai_service import AIService
 from .notification_service import NotificationService
 from .reminder_db import ReminderDatabase
+from .webhook_server import CalendarWebhookServer
+from .config import CONFIG
 from .utils.logger import setup_logger
 
 logger = setup_logger('scheduler')
 
+# How often old sent-reminder records are cleaned up
+CLEANUP_INTERVAL = timedelta(hours=24)
+
+# Most event analyses kept in memory; the least recently used are evicted first
+PROCESSED_EVENTS_MAXSIZE = 4096
+
+# How long analyses are kept after their event has started
+PROCESSED_EVENTS_RETENTION = timedelta(days=1)
+
+# Reminders due within this many seconds are sent now (the next check may be too late)
+REMINDER_LOOKAHEAD_SECONDS = 1200
+
+# Wait before trying again after a watch channel couldn't be created
+WATCH_RETRY_INTERVAL = timedelta(hours=1)
+
+# How often the in-memory database is saved to its file
+DB_BACKUP_INTERVAL_MINUTES = 5
+
 
 class ReminderScheduler:
     """Manages the reminder checking and sending schedule."""
     
     def __init__(self):
-        self.calendar = CalendarService()
+        self.db = ReminderDatabase()
+        self.calendar = CalendarService(self.db)
         self.ai = AIService()
         self.notifier = NotificationService()
-        self.db = ReminderDatabase()
         
-        # Track processed events to avoid re-analyzing
-        self.processed_events = {}
+        # Track processed events to avoid re-analyzing, least recently used first:
+        # event_id -> (event_hash, analysis, start_time)
+        self.processed_events = OrderedDict()
+        
+        # Calendar change notifications (only when a webhook URL is configured)
+        self.webhook = None
+        self._watch_retry_at = None
+        
+        # Last fetched events, reused while the calendar reports no changes
+        self._events_cache = []
+        self._last_fetch = None
+        
+        # When old reminder records were last removed
+        self._last_cleanup = None
     
     def initialize(self):
         """Initialize services (authenticate, etc.)."""
@@ -45,79 +81,218 @@ class ReminderScheduler:
         try:
             logger.info("Checking for events and due reminders...")
             
+            # Keep the SMTP connection from idling out between checks
+            self.notifier.keep_alive()
+            
             # Fetch upcoming events (next 7 days)
-            events = self.calendar.get_upcoming_events(hours_ahead=168)
+            events = self._get_upcoming_events()
             
             if not events:
                 logger.info("No upcoming events found")
                 return
             
             now = datetime.now(events[0]['start_time'].tzinfo)
-            reminders_sent = 0
             
+            # Events whose analysis isn't in memory or is out of date
+            event_hashes = {}
             for event in events:
-                # Check if we've already processed this event
-                event_id = event['id']
                 event_hash = self._get_event_hash(event)
+                cached = self.processed_events.get(event['id'])
+                if cached is not None and cached[0] == event_hash:
+                    self.processed_events.move_to_end(event['id'])
+                else:
+                    event_hashes[event['id']] = event_hash
+            
+            # Reuse analyses stored by a previous run
+            stored = self.db.get_event_analyses(event_hashes) if event_hashes else {}
+            
+            # Analyze new or updated events in batches
+            to_analyze = []
+            for event in events:
+                event_hash = event_hashes.get(event['id'])
+                if event_hash is None:
+                    continue
                 
-                if event_id not in self.processed_events or self.processed_events[event_id] != event_hash:
-                    # New or updated event - analyze it
+                stored_analysis = stored.get(event['id'])
+                if stored_analysis is not None and stored_analysis[0] == event_hash:
+                    self.processed_events[event['id']] = (event_hash, stored_analysis[1], event['start_time'])
+                    self.processed_events.move_to_end(event['id'])
+                else:
                     logger.info(f"Analyzing event: {event['summary']}")
-                    analysis = self.ai.analyze_event_and_generate_reminders(event)
-                    
+                    to_analyze.append(event)
+            
+            if to_analyze:
+                analyses = self.ai.analyze_events_batch(to_analyze)
+                for event, analysis in zip(to_analyze, analyses):
                     # Store the analysis
-                    self.processed_events[event_id] = {
-                        'hash': event_hash,
-                        'analysis': analysis
-                    }
-                else:
-                    # Use cached analysis
-                    analysis = self.processed_events[event_id]['analysis']
+                    self.processed_events[event['id']] = (event_hashes[event['id']], analysis, event['start_time'])
+                    self.processed_events.move_to_end(event['id'])
                 
-                # Check if any reminders are due
-                reminder_times = analysis['reminder_times']
-                reminder_messages = analysis['reminder_messages']
+                # Default reminders aren't stored, so the AI is tried again after a restart
+                self.db.save_event_analyses([
+                    (event['id'], event_hashes[event['id']], analysis)
+                    for event, analysis in zip(to_analyze, analyses)
+                    if not analysis.get('is_fallback')
+                ])
+            
+            # Collect reminders that are due (past or within next 20 minutes), comparing
+            # epoch seconds against a cutoff computed once per check.
+            # Each reminder time is formatted once and used as its key for lookup and insert.
+            due_cutoff = now.timestamp() + REMINDER_LOOKAHEAD_SECONDS
+            due_reminders = []
+            for event in events:
+                analysis = self.processed_events[event['id']][1]
                 
-                for reminder_time, reminder_msg in zip(reminder_times, reminder_messages):
-                    # Check if reminder is due (within the next check interval)
-                    time_until_reminder = (reminder_time - now).total_seconds()
-                    
-                    # Send if reminder is due (past or within next 20 minutes)
-                    if time_until_reminder <= 1200:  # 20 minutes buffer
-                        # Check if already sent
-                        if not self.db.reminder_already_sent(event_id, reminder_time):
-                            # Send the reminder
-                            success = self.notifier.send_reminder(
-                                event,
-                                reminder_msg,
-                                analysis['natural_summary']
-                            )
-                            
-                            if success:
-                                # Mark as sent
-                                self.db.mark_reminder_sent(
-                                    event_id,
-                                    event['summary'],
-                                    event['start_time'],
-                                    reminder_time
-                                )
-                                reminders_sent += 1
+                for reminder_time, reminder_msg in zip(analysis['reminder_times'], analysis['reminder_messages']):
+                    if reminder_time.timestamp() <= due_cutoff:
+                        due_reminders.append(
+                            (event, reminder_time.isoformat(), reminder_msg, analysis['natural_summary'])
+                        )
+            
+            # Check which due reminders were already sent, in a single query
+            if due_reminders:
+                already_sent = self.db.get_sent_set(
+                    (event['id'], reminder_key) for event, reminder_key, _, _ in due_reminders
+                )
+                due_reminders = [
+                    reminder for reminder in due_reminders
+                    if (reminder[0]['id'], reminder[1]) not in already_sent
+                ]
+            
+            # Claim the due reminders before sending, so each one goes out only once.
+            # The claims are committed in one transaction before any network I/O.
+            claimed = self.db.try_claim_reminders([
+                (event['id'], event['summary'], event['start_time'], reminder_key)
+                for event, reminder_key, _, _ in due_reminders
+            ])
+            due_reminders = [reminder for reminder, ok in zip(due_reminders, claimed) if ok]
+            
+            # Send all claimed reminders in one batch, outside any transaction.
+            # If sending raises, release every claim so the next check retries them.
+            try:
+                results = self.notifier.send_reminders_bulk([
+                    (event, reminder_msg, natural_summary)
+                    for event, _, reminder_msg, natural_summary in due_reminders
+                ])
+            except BaseException:
+                self.db.release_reminders([
+                    (event['id'], reminder_key) for event, reminder_key, _, _ in due_reminders
+                ])
+                raise
+            reminders_sent = sum(results)
+            
+            # Release the ones that failed so the next check retries them
+            self.db.release_reminders([
+                (event['id'], reminder_key)
+                for (event, reminder_key, _, _), success in zip(due_reminders, results)
+                if not success
+            ])
             
             if reminders_sent > 0:
                 logger.info(f"✅ Sent {reminders_sent} reminder(s)")
             else:
                 logger.info("No reminders due at this time")
             
-            # Periodic cleanup (once per check)
-            self.db.cleanup_old_reminders(days_old=30)
+            self._prune_processed_events(now)
+            
+            # Periodic cleanup (at most once a day)
+            if self._last_cleanup is None or datetime.now() - self._last_cleanup > CLEANUP_INTERVAL:
+                self.db.cleanup_old_reminders(days_old=30)
+                self._last_cleanup = datetime.now()
         
         except Exception as e:
             logger.error(f"Error in reminder check: {e}", exc_info=True)
     
+    def _prune_processed_events(self, now):
+        """Drop analyses of long-past events and keep the cache within its size limit."""
+        cutoff = now - PROCESSED_EVENTS_RETENTION
+        for event_id in [eid for eid, cached in self.processed_events.items() if cached[2] < cutoff]:
+            del self.processed_events[event_id]
+        
+        while len(self.processed_events) > PROCESSED_EVENTS_MAXSIZE:
+            self.processed_events.popitem(last=False)
+    
+    def _get_upcoming_events(self):
+        """
+        Get upcoming events, re-fetching only when the calendar may have changed.
+        
+        Without an active watch channel the calendar is synced on every check;
+        the sync is incremental, and an unchanged calendar costs one 304 reply.
+        With one, events are re-fetched when a change notification arrived or
+        FALLBACK_POLL_MINUTES have passed since the last fetch.
+        """
+        self._renew_watch()
+        
+        now = datetime.now(self.calendar.timezone)
+        changed = self.webhook.consume_change() if self.webhook else False
+        poll_due = (
+            self._last_fetch is None
+            or now - self._last_fetch >= timedelta(minutes=CONFIG.fallback_poll_minutes)
+        )
+        
+        if changed or poll_due or not self.calendar.is_watching():
+            self._events_cache = self.calendar.get_upcoming_events(hours_ahead=168)
+            self._last_fetch = now
+            return self._events_cache
+        
+        logger.info("No calendar changes notified, using last fetched events")
+        return [event for event in self._events_cache if event['end_time'] > now]
+    
+    def _backup_database(self):
+        """Save the in-memory database to disk; a failure is retried on the next run."""
+        try:
+            self.db.backup()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save database: {e}")
+    
+    def _start_watch(self):
+        """Start receiving calendar change notifications, if configured."""
+        if not CONFIG.calendar_webhook_url:
+            return
+        
+        try:
+            self.webhook = CalendarWebhookServer(
+                CONFIG.calendar_webhook_port, CONFIG.calendar_watch_channel_id, CONFIG.calendar_webhook_token
+            )
+            self.webhook.start()
+        except OSError as e:
+            logger.error(f"Failed to start webhook server, polling instead: {e}")
+            self.webhook = None
+    
+    def _renew_watch(self):
+        """Create the watch channel, or replace it when it's about to expire."""
+        if not self.webhook or not self.calendar.watch_needs_renewal():
+            return
+        
+        now = datetime.now()
+        if self._watch_retry_at is not None and now < self._watch_retry_at:
+            return
+        
+        self.calendar.stop_watch()
+        
+        # A fresh id for every channel, so one left active by an unclean exit
+        # doesn't make the new registration fail until it expires
+        channel_id = f"{CONFIG.calendar_watch_channel_id}-{uuid.uuid4().hex[:16]}"
+        self.webhook.channel_id = channel_id
+        
+        if self.calendar.start_watch(CONFIG.calendar_webhook_url, channel_id, CONFIG.calendar_webhook_token):
+            self._watch_retry_at = None
+            # Changes made while no channel was active weren't notified
+            self.webhook.mark_changed()
+        else:
+            self._watch_retry_at = now + WATCH_RETRY_INTERVAL
+    
     def _get_event_hash(self, event):
         """Generate a hash for an event to detect changes."""
-        # Simple hash based on key fields
-        return f"{event['summary']}_{event['start_time']}_{event['location']}"
+        # Google bumps 'updated' on every edit (description, duration, attendees...),
+        # so any change invalidates the analysis. Integer hash, cheap to compare, built
+        # from a digest rather than hash(), which differs between runs, so stored
+        # analyses stay valid.
+        key = (
+            f"{event['id']}|{event.get('updated')}|{event['start_time'].isoformat()}"
+            f"|{event['summary']}|{event.get('location')}"
+        )
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
     
     def run(self, check_interval_minutes=15):
         """
@@ -128,16 +303,21 @@ class ReminderScheduler:
         """
         logger.info(f"Starting scheduler (checking every {check_interval_minutes} minutes)")
         
-        # Schedule the job
+        # Listen for calendar changes so idle checks can skip the fetch
+        self._start_watch()
+        
+        # Schedule the jobs
         schedule.every(check_interval_minutes).minutes.do(self.check_and_send_reminders)
+        schedule.every(DB_BACKUP_INTERVAL_MINUTES).minutes.do(self._backup_database)
         
         # Run once immediately on startup
         self.check_and_send_reminders()
         
-        # Keep running
+        # Keep running, waking when the next job is due (at least once a minute)
         while True:
             schedule.run_pending()
-            time.sleep(60)  # Check every minute if jobs are due
+            idle = schedule.idle_seconds()
+            time.sleep(60 if idle is None else max(1, min(idle, 60)))
     
     def run_once(self):
         """Run a single check (useful for testing)."""
@@ -147,3 +327,16 @@ class ReminderScheduler:
         # Show stats
         stats = self.db.get_reminder_stats()
         logger.info(f"Stats: {stats}")
+    
+    def shutdown(self):
+        """Stop change notifications and close open connections and the database."""
+        try:
+            if self.webhook:
+                self.calendar.stop_watch()
+                self.webhook.stop()
+                self.webhook = None
+            
+            self.notifier.close()
+        finally:
+            # Always save the in-memory database, even if the rest fails
+            self.db.close()
@@ -0,0 +1,50 @@
+"""
+Persistent background asyncio event loop.
+Lets synchronous code run coroutines without creating a new loop per call,
+so async clients (and their open connections) can be reused.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Get the shared background event loop, starting it on first use.
+    
+    Returns:
+        asyncio event loop running forever in a daemon thread
+    """
+    global _loop
+    
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='async-loop', daemon=True)
+            thread.start()
+    
+    return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """
+    Run a coroutine on the background loop and wait for its result.
+    
+    Args:
+        coro: Coroutine to run
+        timeout: Seconds to wait for the result (None waits forever); the
+            coroutine is cancelled if it runs longer
+    
+    Returns:
+        The coroutine's return value
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
@@ -0,0 +1,81 @@
+"""
+Receiver for Google Calendar push notifications.
+Runs a small HTTP server that flags when the watched calendar has changed.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .utils.logger import setup_logger
+
+logger = setup_logger('webhook')
+
+
+class _NotificationHandler(BaseHTTPRequestHandler):
+    """Handles notification POSTs sent by Google to the watch channel address."""
+    
+    def do_POST(self):
+        webhook = self.server.webhook
+        channel_id = self.headers.get('X-Goog-Channel-ID')
+        token = self.headers.get('X-Goog-Channel-Token')
+        state = self.headers.get('X-Goog-Resource-State')
+        
+        if channel_id != webhook.channel_id or token != webhook.token:
+            logger.warning(f"Ignoring notification with unknown channel or token: {channel_id}")
+            self.send_response(403)
+            self.end_headers()
+            return
+        
+        # 'sync' only confirms the channel was created
+        if state != 'sync':
+            logger.info(f"Calendar change notification received ({state})")
+            webhook.mark_changed()
+        
+        self.send_response(200)
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class CalendarWebhookServer:
+    """Listens for calendar change notifications in a background thread."""
+    
+    def __init__(self, port, channel_id, token=None):
+        self.port = port
+        self.channel_id = channel_id
+        self.token = token
+        self._changed = threading.Event()
+        self._server = None
+    
+    def start(self):
+        """Start serving notifications in a daemon thread."""
+        self._server = ThreadingHTTPServer(('', self.port), _NotificationHandler)
+        self._server.webhook = self
+        
+        thread = threading.Thread(target=self._server.serve_forever, name='calendar-webhook', daemon=True)
+        thread.start()
+        logger.info(f"Listening for calendar notifications on port {self.port}")
+    
+    def stop(self):
+        """Stop the HTTP server."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    def mark_changed(self):
+        """Flag that the calendar has changed since the last fetch."""
+        self._changed.set()
+    
+    def consume_change(self):
+        """
+        Check and clear the change flag.
+        
+        Returns:
+            True if a change was notified since the last call
+        """
+        if self._changed.is_set():
+            self._changed.clear()
+            return True
+        return False